@@ -1,6 +1,5 @@
 from csbot.plugin import Plugin
 from csbot.events import Event
-import asyncio
 from datetime import datetime, timedelta
 import pymongo
 
@@ -17,6 +16,10 @@ class Cron(Plugin):
     if you schedule multiple events at the same time, don't make any
     assumptions about the order in which they'll be called.
 
+    All scheduling happens on the bot's event loop, so no locking is done;
+    code running in another thread should go through
+    ``self.bot.loop.call_soon_threadsafe`` rather than calling cron directly.
+
     Example of usage:
 
         class MyPlugin(Plugin):
@@ -41,6 +44,16 @@ class Cron(Plugin):
     def setup(self):
         super(Cron, self).setup()
 
+        # Every task lookup (duplicate checks, unscheduling) is keyed on the
+        # owner and usually the name, so index on them to avoid scanning.
+        # This can't be a unique index over the whole signature, because
+        # args is a list and would be indexed element by element, making
+        # distinct tasks that share any argument collide.
+        self.tasks.create_index([('owner', pymongo.ASCENDING),
+                                 ('name', pymongo.ASCENDING)])
+        # The scheduler only ever wants the earliest task(s)
+        self.tasks.create_index('when')
+
         # Schedule own events with the same API other plugins will use
         self.cron = self.provide(self.plugin_name())
 
@@ -123,7 +136,7 @@ class Cron(Plugin):
         :param when:     The datetime to trigger the task at
         :param interval: Optionally, reschedule at when + interval
                          when triggered. Gives rise to repeating
-                         tasks.
+                         tasks.  Must be positive.
         :param callback: Call owner.callback when triggered; if None,
                          call owner.name.
         :param args:     Callback positional arguments.
@@ -134,25 +147,29 @@ class Cron(Plugin):
         :exc:`DuplicateTaskError`.  Any subset of the signature can be used to
         :meth:`unschedule` all matching tasks (``owner`` is mandatory).
         """
-        # Create the new task
+        if interval is not None and interval <= timedelta(0):
+            raise ValueError('Task interval must be positive', interval)
+
+        # The task signature, which also forms the identifying part of the
+        # new task document.  Not using match_task() here, because that
+        # leaves out a name of None, and the task would be stored without one.
+        match = {'owner': owner,
+                 'name': name,
+                 'args': args or [],
+                 'kwargs': kwargs or {}}
+
+        # Create the new task only if nothing matches its signature; doing
+        # the check and the insert as a single upsert saves a round trip to
+        # the database
         secs = interval.total_seconds() if interval is not None else None
-        task = {'owner': owner,
-                'name': name,
-                'when': when,
-                'interval': secs,
-                'callback': callback or name,
-                'args': args or [],
-                'kwargs': kwargs or {}}
-
-        # See if this task duplicates another
-        match = self.match_task(task['owner'], task['name'],
-                                task['args'], task['kwargs'])
-        if self.tasks.find_one(match):
+        result = self.tasks.update_one(match, {'$setOnInsert': {
+            'when': when,
+            'interval': secs,
+            'callback': callback or name,
+        }}, upsert=True)
+        if result.upserted_id is None:
             raise DuplicateTaskError('Identical task already scheduled', match)
 
-        # If we made it this far, save the task
-        self.tasks.insert(task)
-
         # Reschedule the event runner in case it now needs to happen earlier
         self.schedule_event_runner()
 
@@ -178,16 +195,15 @@ class Cron(Plugin):
         now = datetime.now()
         # There will always be at least one event remaining because we
         # have three repeating ones, so this is safe.
-        remaining_tasks = self.tasks.find().sort('when', pymongo.ASCENDING)
-        next_run = remaining_tasks[0]['when']
+        next_task = self.tasks.find_one(sort=[('when', pymongo.ASCENDING)])
+        next_run = next_task['when']
 
         if self.scheduler_next is None or next_run != self.scheduler_next:
             if self.scheduler is not None:
                 self.scheduler.cancel()
             delay = (next_run - now).total_seconds()
             self.log.debug('calling event runner in %s seconds', delay)
-            # TODO: need a better API for using the bot's event loop
-            self.scheduler = asyncio.get_event_loop().call_later(delay, self.event_runner)
+            self.scheduler = self.bot.loop.call_later(delay, self.event_runner)
             self.scheduler_next = next_run
         else:
             self.log.debug('already scheduled for %s', self.scheduler_next)
@@ -201,14 +217,18 @@ class Cron(Plugin):
         now = datetime.now()
         self.log.debug('running event runner at %s', now)
 
+        # The delayed call has now fired, so forget about it.  The loop's
+        # monotonic clock and the wall clock used for task times can
+        # disagree, so this might be slightly early and find nothing to run;
+        # without this, schedule_event_runner() would then see the same next
+        # task and never schedule another call.
+        self.scheduler = None
+        self.scheduler_next = None
+
         # Find and run every task from before now
         for taskdef in self.tasks.find({'when': {'$lt': now}}):
-            # Going to be using this a lot
-            task_name = u'{}/{}'.format(
-                taskdef['owner'],
-                taskdef['name'])
-
-            self.log.info(u'Running task ' + task_name)
+            self.log.info('Running task %s/%s',
+                          taskdef['owner'], taskdef['name'])
 
             # Now that we have the task, we need to remove it from the
             # database (or reschedule it for the future) straight
@@ -216,11 +236,19 @@ class Cron(Plugin):
             # will be called again, but the task will still be there
             # (and so be run again), resulting in an error when it
             # tries to schedule the second time.
+            #
+            # If a repeating task has fallen more than one interval behind
+            # (e.g. the bot was down), skip straight to the next time in the
+            # future instead of firing once for every missed interval.
             if taskdef['interval'] is not None:
-                taskdef['when'] += timedelta(seconds=taskdef['interval'])
+                interval = timedelta(seconds=taskdef['interval'])
+                missed = (now - taskdef['when']) // interval + 1
+                taskdef['when'] += interval * missed
                 self.tasks.save(taskdef)
             else:
-                self.unschedule(taskdef['owner'], taskdef['name'])
+                # Remove just this task; unscheduling by (owner, name) would
+                # take all of the owner's tasks with it if the name is None
+                self.tasks.remove({'_id': taskdef['_id']})
 
             # There are two things that could go wrong in running a
             # task. The method might not exist, this can arise in two
@@ -236,13 +264,11 @@ class Cron(Plugin):
             try:
                 func = getattr(self.bot.plugins[taskdef['owner']],
                                taskdef['callback'])
-            except AttributeError:
-                self.log.error(
-                    u'Couldn\'t find method {}.{} for task {}'.format(
-                        taskdef['owner'],
-                        taskdef['callback'],
-                        task_name))
-                self.unschedule(taskdef['owner'], taskdef['name'])
+            except (KeyError, AttributeError):
+                self.log.error('Couldn\'t find method %s.%s for task %s/%s',
+                               taskdef['owner'], taskdef['callback'],
+                               taskdef['owner'], taskdef['name'])
+                self.tasks.remove({'_id': taskdef['_id']})
                 continue
 
             # The second way is if the method does exist, but raises
@@ -254,14 +280,11 @@ class Cron(Plugin):
             # shouldn't get this far anyway, killing the bot is worse.
             try:
                 func(taskdef['when'], *taskdef['args'], **taskdef['kwargs'])
-            except Exception as e:
+            except Exception:
                 # Don't really want exceptions to kill cron, so let's just log
-                # them as an error.
-
-                self.log.error(
-                    u'Exception raised when running task {}: {} {}'.format(
-                        task_name,
-                        type(e), e.args))
+                # them as an error (with the traceback).
+                self.log.exception('Exception raised when running task %s/%s',
+                                   taskdef['owner'], taskdef['name'])
 
         # Schedule the event runner for the next task
         self.schedule_event_runner()
@@ -293,6 +316,8 @@ class PluginCron(object):
     These functions will raise a DuplicateNameException if you try to
     schedule two events with the same name.
     """
+    __slots__ = ('cron', 'plugin')
+
     def __init__(self, cron, plugin):
         self.cron = cron
         self.plugin = plugin
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
+import mongomock
+
+from csbot.test import BotTestCase
+from csbot.plugins.cron import DuplicateTaskError
+
+
+class TestCronPlugin(BotTestCase):
+    CONFIG = """\
+    [@bot]
+    plugins = mongodb cron
+
+    [mongodb]
+    mode = mock
+    """
+
+    PLUGINS = ['cron']
+
+    def setUp(self):
+        super().setUp()
+        # Make sure we can't accidentally write to a real database
+        assert isinstance(self.cron.tasks, mongomock.Collection), \
+            'Not mocking MongoDB -- may be writing to actual database (!)'
+
+    def tearDown(self):
+        # Don't leave the event runner to fire after the test has finished
+        self.cron.teardown()
+        super().tearDown()
+
+    def test_early_wakeup_reschedules(self):
+        old_scheduler = self.cron.scheduler
+        old_next = self.cron.scheduler_next
+        self.assertIsNotNone(old_scheduler)
+
+        # Nothing is due yet, like when the event loop wakes up early
+        self.cron.event_runner()
+
+        self.assertIsNotNone(self.cron.scheduler)
+        self.assertIsNot(self.cron.scheduler, old_scheduler)
+        self.assertEqual(self.cron.scheduler_next, old_next)
+
+    def test_overdue_repeating_task_runs_once(self):
+        when = datetime.now().replace(microsecond=0) - timedelta(hours=3,
+                                                                 minutes=30)
+        self.cron.schedule('cron', 'overdue', when,
+                           interval=timedelta(hours=1),
+                           callback='fire_event',
+                           args=['test.overdue'])
+
+        with mock.patch.object(self.cron, 'fire_event') as fire_event:
+            self.cron.event_runner()
+            fire_event.assert_called_once_with(when + timedelta(hours=4),
+                                               'test.overdue')
+            # Now back in the future, so running again does nothing
+            self.cron.event_runner()
+            self.assertEqual(fire_event.call_count, 1)
+
+        task = self.cron.tasks.find_one({'owner': 'cron', 'name': 'overdue'})
+        self.assertEqual(task['when'], when + timedelta(hours=4))
+
+    def test_zero_interval_rejected(self):
+        with self.assertRaises(ValueError):
+            self.cron.schedule('cron', 'zero', datetime.now(),
+                               interval=timedelta(0),
+                               callback='fire_event')
+        self.assertIsNone(self.cron.tasks.find_one({'name': 'zero'}))
+
+    def test_duplicate_task(self):
+        when = datetime.now() + timedelta(hours=1)
+        self.cron.schedule('cron', 'dup', when, callback='fire_event',
+                           args=['a'], kwargs={'b': 1})
+        with self.assertRaises(DuplicateTaskError):
+            self.cron.schedule('cron', 'dup', when, callback='fire_event',
+                               args=['a'], kwargs={'b': 1})
+        # Different args give a different signature
+        self.cron.schedule('cron', 'dup', when, callback='fire_event',
+                           args=['c'], kwargs={'b': 1})
+        self.assertEqual(self.cron.tasks.find({'name': 'dup'}).count(), 2)
+
+    def test_unnamed_task(self):
+        when = datetime.now().replace(microsecond=0) - timedelta(minutes=1)
+        self.cron.schedule('cron', None, when, callback='fire_event',
+                           args=['test.unnamed'])
+        self.assertIn('name', self.cron.tasks.find_one({'name': None}))
+
+        with mock.patch.object(self.cron, 'fire_event') as fire_event:
+            self.cron.event_runner()
+            fire_event.assert_called_once_with(when, 'test.unnamed')
+
+        # Only the unnamed task is removed, not every other cron task
+        self.assertIsNone(self.cron.tasks.find_one({'name': None}))
+        self.assertIsNotNone(self.cron.tasks.find_one({'name': 'hourly'}))
+
+    def test_missing_owner(self):
+        when = datetime.now().replace(microsecond=0) - timedelta(minutes=1)
+        self.cron.schedule('notloaded', 'orphan', when, callback='foo')
+        self.cron.schedule('cron', 'other', when, callback='fire_event',
+                           args=['test.other'])
+
+        with mock.patch.object(self.cron, 'fire_event') as fire_event, \
+                self.assertLogs('csbot.plugins.cron', 'ERROR') as logs:
+            self.cron.event_runner()
+            fire_event.assert_called_once_with(when, 'test.other')
+
+        self.assertIn('notloaded.foo', logs.output[0])
+        self.assertIsNone(self.cron.tasks.find_one({'owner': 'notloaded'}))